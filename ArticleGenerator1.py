@@ -1,14 +1,31 @@
+import asyncio
+import contextvars
+import io
+import queue
+import threading
+import time
 import traceback
 import requests
 import streamlit as st
 import os
 import json
 import warnings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from crewai import Agent, Task, Crew, Process
 import openai
-from azure.identity import DefaultAzureCredential
+import orjson
+from openai import AzureOpenAI
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_openai import AzureChatOpenAI
+import tiktoken
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+from azure.identity import DefaultAzureCredential, get_bearer_token_provider
 from azure.keyvault.secrets import SecretClient
 from dotenv import load_dotenv
+from llm_cache import SQLiteCacheBackend, make_cache_key
+from state_store import StateStore
+from semantic_cache import SemanticCache
 
 # Load environment variables
 load_dotenv()
@@ -16,6 +33,41 @@ load_dotenv()
 # Suppress warnings
 warnings.filterwarnings('ignore')
 
+# Reuse one pooled keep-alive HTTP session across reruns
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=20,
+        # raise_on_status=False hands the last response back so raise_for_status()
+        # reports it as an HTTPError instead of a response-less RetryError
+        max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504],
+                          raise_on_status=False)
+    ))
+    return session
+
+SESSION = get_http_session()
+
+# Build the Key Vault client once per process
+@st.cache_resource
+def get_secret_client(vault_uri):
+    return SecretClient(vault_url=vault_uri, credential=DefaultAzureCredential())
+
+# Fetch a Key Vault secret once; failures raise and are not cached
+@st.cache_resource
+def get_key_vault_secret(vault_uri, name):
+    return get_secret_client(vault_uri).get_secret(name).value
+
+# Authenticate to Azure OpenAI with Microsoft Entra ID (e.g. a managed identity) instead of an API key
+use_entra_id = os.getenv("AZURE_OPENAI_USE_ENTRA_ID", "").lower() in ("1", "true", "yes")
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+# One credential per process; the SDK caches and refreshes the access token
+@st.cache_resource
+def get_token_provider():
+    return get_bearer_token_provider(DefaultAzureCredential(), COGNITIVE_SERVICES_SCOPE)
+
 # Configure Azure authentication
 def get_azure_credentials():
     try:
@@ -23,15 +75,16 @@ def get_azure_credentials():
         azure_api_key = os.getenv("AZURE_OPENAI_API_KEY")
         if azure_api_key:
             return azure_api_key
+
+        # Entra ID authentication needs no key, so skip the Key Vault round trip
+        if use_entra_id:
+            return None
         
         # If not in environment variables, try Azure Key Vault
         key_vault_name = os.getenv("AZURE_KEY_VAULT_NAME")
         if key_vault_name:
             key_vault_uri = f"https://{key_vault_name}.vault.azure.net/"
-            credential = DefaultAzureCredential()
-            secret_client = SecretClient(vault_url=key_vault_uri, credential=credential)
-            azure_api_key = secret_client.get_secret("AZURE-OPENAI-API-KEY").value
-            return azure_api_key
+            return get_key_vault_secret(key_vault_uri, "AZURE-OPENAI-API-KEY")
         
         # If neither is available, return None
         return None
@@ -39,33 +92,85 @@ def get_azure_credentials():
         st.error(f"Error getting Azure credentials: {str(e)}")
         return None
 
-# Helper function to load and save configurations
+# Config and response cache share one SQLite store per process
+@st.cache_resource
+def get_state_store():
+    return StateStore()
+
+# Helper function to load and save configurations; reads the store directly so a
+# save in another process is picked up by the next session
 def load_config():
+    data = get_state_store().get("prompts")
+    if data is not None:
+        return orjson.loads(data)
+
+    # Fall back to a config saved by earlier versions of the app
     try:
-        with open("agent_task_config.json", "r") as f:
-            return json.load(f)
+        with open("agent_task_config.json", "rb") as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         return {}
 
+# Save the config in one transaction, skipping the write when the shared store
+# already holds the same config (possibly saved by another session or process)
 def save_config(config):
-    with open("agent_task_config.json", "w") as f:
-        json.dump(config, f)
+    store = get_state_store()
+    stored = store.get("prompts")
+    if stored is not None and orjson.loads(stored) == config:
+        return False
+
+    # Keys are stored in their original order so the planner/writer/editor and
+    # plan/write/edit inputs render in pipeline order
+    store.set("prompts", orjson.dumps(config, option=orjson.OPT_INDENT_2))
+    return True
+
+# Cached article responses live for one day
+CACHE_TTL_SECONDS = 86400
+
+# Keep one response cache per session so hit/miss counters survive reruns
+if 'llm_cache' not in st.session_state:
+    st.session_state['llm_cache'] = SQLiteCacheBackend(get_state_store())
+llm_cache = st.session_state['llm_cache']
+
+# The semantic cache shares the process-wide state store
+@st.cache_resource
+def get_semantic_cache():
+    return SemanticCache(get_state_store())
 
-# Load persisted configurations at startup
-config = load_config()
+semantic_cache = get_semantic_cache()
 
 # Streamlit UI
 st.title("Research Article Generator")
 
+# Response cache controls
+with st.sidebar:
+    st.header("Response Cache")
+    cache_stats = st.empty()
+    if st.button("Clear cache"):
+        llm_cache.clear()
+        semantic_cache.clear()
+        st.success("Cache cleared.")
+
+    st.header("Semantic Cache")
+    similarity_threshold = st.slider("Similarity threshold for reusing an earlier article (1.00 disables)",
+                                     min_value=0.80, max_value=1.00, value=0.93, step=0.01,
+                                     help="Only used when the temperature is 0. Transcripts longer than "
+                                          "the embedding model's input limit are always generated fresh.")
+    st.caption("Applies only to runs at temperature 0.")
+
 # File uploader
-uploaded_file = st.file_uploader("Upload your transcript file", type="txt")
-st.write(uploaded_file)
+uploaded_files = st.file_uploader("Upload your transcript files", type="txt", accept_multiple_files=True)
+for uploaded_file in uploaded_files or []:
+    st.caption(f"{uploaded_file.name} · {uploaded_file.size / 1024:.1f} KB")
+
+# Batch mode sends every transcript through the Azure OpenAI Batch API in one job
+batch_mode = st.checkbox("Batch mode (Azure OpenAI Batch API, results may take longer)")
 
 # Try to get Azure credentials
 azure_api_key = get_azure_credentials()
 
 # Only show API key input if not available from Azure authentication
-if not azure_api_key:
+if not azure_api_key and not use_entra_id:
     azure_api_key = st.text_input("Enter your Azure OpenAI API Key", type="password")
     azure_api_key = azure_api_key.strip() if azure_api_key else ""
 
@@ -73,41 +178,465 @@ if not azure_api_key:
 azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT", "https://rstapestryopenai2.openai.azure.com/")
 azure_deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4")
 azure_api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
+azure_embedding_deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
+azure_batch_api_version = os.getenv("AZURE_OPENAI_BATCH_API_VERSION", "2024-10-21")
+# Batch jobs need a deployment of the Global Batch type, separate from the chat deployment
+azure_batch_deployment = os.getenv("AZURE_OPENAI_BATCH_DEPLOYMENT", azure_deployment)
+
+# Authentication headers for direct Azure OpenAI REST calls
+def get_auth_headers():
+    if azure_api_key:
+        return {"api-key": azure_api_key}
+    return {"Authorization": f"Bearer {get_token_provider()()}"}
+
+# Reusable Azure OpenAI client, rebuilt only when credentials change; its own
+# retries are off because embed_text retries with embedding_retry
+@st.cache_resource
+def get_aoai_client(api_key, endpoint, api_version):
+    auth = {"api_key": api_key} if api_key else {"azure_ad_token_provider": get_token_provider()}
+    return AzureOpenAI(azure_endpoint=endpoint, api_version=api_version, max_retries=0, **auth)
+
+# Retries per chat call; the OpenAI SDK backs off exponentially and honors
+# Retry-After, so a 429 repeats only that LLM call rather than the whole crew
+LLM_MAX_RETRIES = 5
+
+# Chat model used by the agents; every model honors Stop, and streaming models
+# forward tokens to the active TokenSink
+def build_llm(temperature, deployment, api_key, streaming=False):
+    auth = {"api_key": api_key} if api_key else {"azure_ad_token_provider": get_token_provider()}
+    return AzureChatOpenAI(
+        azure_endpoint=azure_endpoint,
+        azure_deployment=deployment,
+        api_version=azure_api_version,
+        temperature=temperature,
+        streaming=streaming,
+        max_retries=LLM_MAX_RETRIES,
+        callbacks=[TOKEN_STREAM_HANDLER],
+        **auth
+    )
+
+PROBE_TIMEOUT_SECONDS = 5
 
 # Configure OpenAI settings
 def setup_azure_openai():
     try:
-        # Set OpenAI API configurations
-        openai.api_type = "azure"
-        openai.api_key = azure_api_key
-        openai.api_base = azure_endpoint
-        openai.api_version = azure_api_version
-
-        # Test the connection
-        response = requests.post(
-            f"{azure_endpoint}openai/deployments/{azure_deployment}/chat/completions?api-version={azure_api_version}",
-            headers={
-                "api-key": azure_api_key,
-                "Content-Type": "application/json"
-            },
-            json={
-                "messages": [{"role": "system", "content": "Test connection."}],
-                "max_tokens": 5
-            }
+        # Skip the check when these credentials already passed in this session
+        cred_hash = hash((azure_api_key, azure_endpoint, azure_api_version, azure_deployment))
+        if st.session_state.get('_aoai_ok_hash') == cred_hash:
+            return True
+
+        # Check the credentials with an unbilled model listing
+        response = SESSION.get(
+            f"{azure_endpoint}openai/models?api-version={azure_api_version}",
+            headers=get_auth_headers(),
+            timeout=PROBE_TIMEOUT_SECONDS
         )
         response.raise_for_status()
+        st.session_state['_aoai_ok_hash'] = cred_hash
         return True
     except Exception as e:
         st.error(f"Azure OpenAI Setup Error: {str(e)}")
         return False
 
-# Temperature slider
-temperature = st.slider("Set the temperature for the output (0 = deterministic, 1 = creative)", 
-                       min_value=0.0, max_value=1.0, value=0.7)
+# Instructions for the editor's style pass, prepared alongside the content plan
+STYLE_RULES_TASK = "Prepare a concise list of style, tone and formatting rules to apply when editing the research article"
 
-# Define prompts for agents and tasks
+# Bound concurrent crew runs per endpoint across every session of this process.
+# A threading semaphore is used because each click runs its own event loop.
+@st.cache_resource
+def get_llm_semaphore(endpoint):
+    return threading.BoundedSemaphore(int(os.getenv("AOAI_MAX_CONCURRENCY", "8")))
+
+# Transient Azure OpenAI errors worth retrying for embedding calls; chat calls
+# retry inside the model itself (see LLM_MAX_RETRIES)
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+_exponential_backoff = wait_exponential_jitter(initial=1, max=30)
+MAX_RETRY_AFTER_SECONDS = 60
+
+# Honor the service's Retry-After header, falling back to jittered exponential backoff
+def wait_retry_after(retry_state):
+    response = getattr(retry_state.outcome.exception(), "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return min(float(retry_after), MAX_RETRY_AFTER_SECONDS)
+    except (TypeError, ValueError):
+        return _exponential_backoff(retry_state)
+
+embedding_retry = retry(
+    wait=wait_retry_after,
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    reraise=True
+)
+
+# Run a crew once a concurrency slot for the endpoint is free
+def run_crew(crew):
+    with get_llm_semaphore(azure_endpoint):
+        return crew.kickoff()
+
+# Run a crew in a worker thread so several crews can overlap
+async def kickoff_async(crew):
+    return await asyncio.to_thread(run_crew, crew)
+
+# Cancellation flag of the current generation run. Set in the script thread and
+# inherited by worker threads, so every LLM call of the run can see it.
+_run_abort = contextvars.ContextVar("run_abort", default=None)
+
+# Tokens of the current streaming run; set inside the worker thread running the crew
+_token_sink = contextvars.ContextVar("token_sink", default=None)
+
+# How often a waiting script touches the page so a Stop click is handled
+STOP_POLL_SECONDS = 0.5
+
+def start_run():
+    _run_abort.set(threading.Event())
+
+def abort_run():
+    abort = _run_abort.get()
+    if abort is not None:
+        abort.set()
+
+def run_aborted():
+    abort = _run_abort.get()
+    return st.session_state.get('_abort', False) or (abort is not None and abort.is_set())
+
+# Collects streamed tokens from the worker running the final crew
+class TokenSink:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.result = None
+        self.error = None
+
+    def tokens(self, heartbeat):
+        started = time.time()
+        while True:
+            try:
+                token = self.queue.get(timeout=STOP_POLL_SECONDS)
+            except queue.Empty:
+                # No token yet (e.g. the writer is still running): touch the page so
+                # a pending Stop rerun interrupts the script here
+                heartbeat.caption(f"Generating... {int(time.time() - started)}s elapsed")
+                continue
+            if token is None:
+                return
+            yield token
+
+# Shared callback that stops LLM calls of an aborted run and routes streamed
+# tokens to whichever run is active in the calling thread
+class TokenStreamHandler(BaseCallbackHandler):
+    raise_error = True
+
+    def _check_abort(self):
+        abort = _run_abort.get()
+        if abort is not None and abort.is_set():
+            raise RuntimeError("Generation stopped by user.")
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._check_abort()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._check_abort()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self._check_abort()
+        sink = _token_sink.get()
+        if sink is not None:
+            sink.queue.put(token)
+
+TOKEN_STREAM_HANDLER = TokenStreamHandler()
+
+# Run a blocking call in a worker thread while the script keeps touching the
+# page, so a Stop click interrupts promptly and cancels the remaining LLM calls
+def run_interruptible(func, *args):
+    context = contextvars.copy_context()
+    outcome = {}
+
+    def worker():
+        try:
+            outcome["result"] = context.run(func, *args)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    heartbeat = st.empty()
+    started = time.time()
+    try:
+        while thread.is_alive():
+            thread.join(STOP_POLL_SECONDS)
+            heartbeat.caption(f"Working... {int(time.time() - started)}s elapsed")
+    except BaseException:
+        # Streamlit interrupts the script with a control exception on Stop
+        abort_run()
+        raise
+    heartbeat.empty()
+
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+# Run a crew in the background and stream its tokens into the page
+def stream_crew(crew):
+    sink = TokenSink()
+    context = contextvars.copy_context()
+
+    def worker():
+        context.run(_token_sink.set, sink)
+        try:
+            sink.result = context.run(run_crew, crew)
+        except Exception as e:
+            sink.error = e
+        finally:
+            sink.queue.put(None)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    heartbeat = st.empty()
+    try:
+        st.write_stream(sink.tokens(heartbeat))
+    except BaseException:
+        abort_run()
+        raise
+    heartbeat.empty()
+    thread.join()
+
+    if sink.error is not None:
+        raise sink.error
+    return sink.result
+
+def request_abort():
+    st.session_state['_abort'] = True
+
+# Produce the content plan and the editor's style rules concurrently
+async def prepare_article(prep_crew, style_crew):
+    prep_task = asyncio.create_task(kickoff_async(prep_crew))
+    style_task = asyncio.create_task(kickoff_async(style_crew))
+    return await asyncio.gather(prep_task, style_task)
+
+# Transcripts longer than this many tokens are summarized, then truncated, before planning
+TRANSCRIPT_TOKEN_BUDGET = 8000
+TRANSCRIPT_READ_CHARS = 65536
+SUMMARY_CHUNK_TOKENS = 3000
+
+SUMMARIZER_PROMPTS = {
+    "role": "Transcript Summarizer",
+    "goal": "Condense transcript excerpts without losing facts, figures or speaker positions",
+    "backstory": "You prepare long transcripts so the Content Planner can work from a compact summary."
+}
+SUMMARIZE_TASK = "Summarize this transcript excerpt in detail, keeping every fact, figure and named speaker"
+
+# Decode an uploaded transcript incrementally instead of copying the whole byte buffer
+def read_transcript(uploaded_file):
+    uploaded_file.seek(0)
+    text_io = io.TextIOWrapper(uploaded_file, encoding="utf-8")
+    try:
+        return "".join(iter(lambda: text_io.read(TRANSCRIPT_READ_CHARS), ""))
+    finally:
+        # Leave the uploaded file open for later reruns
+        text_io.detach()
+
+@st.cache_resource
+def get_encoding():
+    return tiktoken.encoding_for_model("gpt-4")
+
+# Split a transcript on paragraph boundaries into chunks of roughly SUMMARY_CHUNK_TOKENS
+def chunk_transcript(transcripts):
+    encoding = get_encoding()
+    chunks, current, current_tokens = [], [], 0
+
+    for paragraph in transcripts.split("\n\n"):
+        tokens = encoding.encode(paragraph)
+
+        # Paragraphs that are too long on their own are cut into token windows
+        windows = [tokens[i:i + SUMMARY_CHUNK_TOKENS] for i in range(0, len(tokens), SUMMARY_CHUNK_TOKENS)] or [tokens]
+
+        for window in windows:
+            if current and current_tokens + len(window) > SUMMARY_CHUNK_TOKENS:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(paragraph if len(windows) == 1 else encoding.decode(window))
+            current_tokens += len(window)
+
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+# Summarize transcript chunks in parallel and join the summaries in order
+async def summarize_transcript(transcripts):
+    crews = []
+    for chunk in chunk_transcript(transcripts):
+        # Each chunk gets its own agent since the summaries run concurrently
+        summarizer = Agent(
+            role=SUMMARIZER_PROMPTS['role'],
+            goal=SUMMARIZER_PROMPTS['goal'],
+            backstory=SUMMARIZER_PROMPTS['backstory'],
+            allow_delegation=False,
+            verbose=True,
+            llm=build_llm(temperature, azure_deployment, azure_api_key)
+        )
+        crews.append(Crew(
+            agents=[summarizer],
+            tasks=[Task(description=f"{SUMMARIZE_TASK}: {chunk}", agent=summarizer)],
+            verbose=True
+        ))
+
+    summaries = await asyncio.gather(*(kickoff_async(crew) for crew in crews))
+    return "\n\n".join(str(summary) for summary in summaries)
+
+# Input token limit of the embedding model
+EMBEDDING_MAX_TOKENS = 8000
+
+# Embed a transcript for semantic cache lookups
+@embedding_retry
+def embed_text(text):
+    client = get_aoai_client(azure_api_key, azure_endpoint, azure_api_version)
+    response = client.embeddings.create(model=azure_embedding_deployment, input=text)
+    return response.data[0].embedding
+
+# Seconds between batch status checks
+BATCH_POLL_SECONDS = 30
+
+# Render the transcript-independent parts of every prompt once per prompt configuration
+@st.cache_data
+def render_static_prompts(prompts_json):
+    prompts = json.loads(prompts_json)
+    writer = prompts['writer']
+    steps = "\n".join(
+        f"{number}. {prompts['tasks'][task]}"
+        for number, task in enumerate(("plan", "write", "edit"), start=1)
+    )
+    return {
+        "plan_prefix": prompts['tasks']['plan'],
+        "write": prompts['tasks']['write'],
+        "edit": prompts['tasks']['edit'],
+        "batch_system": f"You are a {writer['role']}. {writer['goal']}. {writer['backstory']}",
+        "batch_user_prefix": f"Complete these steps and return only the final research article:\n{steps}\n\nTranscript:\n"
+    }
+
+# Collapse the plan/write/edit steps into a single chat request for batch mode
+def build_messages(static_prompts, transcript):
+    return [
+        {"role": "system", "content": static_prompts['batch_system']},
+        {"role": "user", "content": static_prompts['batch_user_prefix'] + transcript}
+    ]
+
+# Submit all transcripts as one Azure OpenAI batch job and display the articles
+def submit_batch(files):
+    base_url = f"{azure_endpoint}openai"
+    params = {"api-version": azure_batch_api_version}
+    # Headers are built per request: a batch can poll for hours and Entra ID
+    # tokens expire, while the token provider caches and refreshes them
+    names = {f"t{i}": uploaded_file.name for i, uploaded_file in enumerate(files)}
+    static_prompts = render_static_prompts(json.dumps(st.session_state['prompts'], sort_keys=True))
+
+    # Build the JSONL input, one chat completion request per transcript
+    encoding = get_encoding()
+    batch_requests = []
+    for i, uploaded_file in enumerate(files):
+        # Batch requests skip the summarizer, so cut long transcripts to the budget
+        transcript = read_transcript(uploaded_file)
+        tokens = encoding.encode(transcript)
+        if len(tokens) > TRANSCRIPT_TOKEN_BUDGET:
+            st.warning(f"{uploaded_file.name} is longer than {TRANSCRIPT_TOKEN_BUDGET} tokens and was truncated for batch mode.")
+            transcript = encoding.decode(tokens[:TRANSCRIPT_TOKEN_BUDGET])
+
+        batch_requests.append({
+            "custom_id": f"t{i}",
+            "method": "POST",
+            "url": "/chat/completions",
+            "body": {
+                "model": azure_batch_deployment,
+                "messages": build_messages(static_prompts, transcript),
+                "temperature": temperature
+            }
+        })
+
+    # Upload the input file
+    response = SESSION.post(
+        f"{base_url}/files",
+        params=params,
+        headers=get_auth_headers(),
+        data={"purpose": "batch"},
+        files={"file": ("transcripts.jsonl", b"\n".join(orjson.dumps(r) for r in batch_requests), "application/jsonl")}
+    )
+    response.raise_for_status()
+    input_file_id = response.json()["id"]
+
+    # Create the batch job
+    response = SESSION.post(
+        f"{base_url}/batches",
+        params=params,
+        headers=get_auth_headers(),
+        json={
+            "input_file_id": input_file_id,
+            "endpoint": "/chat/completions",
+            "completion_window": "24h"
+        }
+    )
+    response.raise_for_status()
+    batch = response.json()
+
+    # Poll until the job reaches a terminal state
+    progress = st.progress(0.0, text=f"Batch {batch['id']}: {batch['status']}")
+    while batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_SECONDS)
+        response = SESSION.get(f"{base_url}/batches/{batch['id']}", params=params, headers=get_auth_headers())
+        response.raise_for_status()
+        batch = response.json()
+
+        counts = batch.get("request_counts") or {}
+        done = counts.get("completed", 0) + counts.get("failed", 0)
+        progress.progress(done / max(counts.get("total", 0), 1), text=f"Batch {batch['id']}: {batch['status']}")
+
+    if batch["status"] != "completed":
+        st.error(f"Batch {batch['id']} finished with status '{batch['status']}'.")
+        # Validation problems with the input file are reported on the batch itself
+        for error in (batch.get("errors") or {}).get("data") or []:
+            line = f" (line {error['line']})" if error.get("line") else ""
+            st.error(f"{error.get('code')}: {error.get('message')}{line}")
+
+    # Successful requests land in the output file and failed ones in the error file;
+    # expired or cancelled batches may still have partial results in either
+    outputs = []
+    for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+        if file_id:
+            response = SESSION.get(f"{base_url}/files/{file_id}/content", params=params, headers=get_auth_headers())
+            response.raise_for_status()
+            outputs.extend(orjson.loads(line) for line in response.text.splitlines() if line.strip())
+
+    if not outputs:
+        if batch["status"] == "completed":
+            st.error(f"Batch {batch['id']} completed but returned no results.")
+        return
+
+    # Display the per-transcript results in upload order
+    order = list(names)
+    outputs.sort(key=lambda output: order.index(output["custom_id"]) if output["custom_id"] in order else len(order))
+    failed = 0
+    for output in outputs:
+        st.subheader(names.get(output["custom_id"], output["custom_id"]))
+        body = (output.get("response") or {}).get("body") or {}
+        if output.get("error") or not body.get("choices"):
+            failed += 1
+            st.error(f"Request failed: {output.get('error') or body.get('error') or body}")
+        else:
+            st.markdown(body["choices"][0]["message"]["content"])
+
+    # Transcripts missing from both files never produced a result
+    for custom_id in set(names) - {output["custom_id"] for output in outputs}:
+        failed += 1
+        st.subheader(names[custom_id])
+        st.error("No result was returned for this transcript.")
+
+    if failed:
+        st.warning(f"Batch processing finished: {len(names) - failed} succeeded, {failed} failed.")
+    else:
+        st.success("Batch processing completed!")
+
+# Define prompts for agents and tasks, loading the persisted configuration once per session
 if 'prompts' not in st.session_state:
-    st.session_state['prompts'] = config or {
+    st.session_state['prompts'] = load_config() or {
         "planner": {
             "role": "Content Planner",
             "goal": "Plan engaging and factually accurate content on the given topic",
@@ -130,125 +659,254 @@ if 'prompts' not in st.session_state:
         }
     }
 
-# User inputs for each prompt
-st.header("Agent Prompts")
-
-for agent, prompts in st.session_state['prompts'].items():
-    if agent != "tasks":
-        st.subheader(f"{agent.capitalize()} Agent")
-        prompts["role"] = st.text_input(f"{agent.capitalize()} Role", 
-                                      value=prompts["role"], 
-                                      key=f"{agent}_role")
-        prompts["goal"] = st.text_area(f"{agent.capitalize()} Goal", 
-                                     value=prompts["goal"], 
-                                     key=f"{agent}_goal")
-        prompts["backstory"] = st.text_area(f"{agent.capitalize()} Backstory", 
-                                          value=prompts["backstory"], 
-                                          key=f"{agent}_backstory")
-
-st.header("Task Descriptions")
-for task, description in st.session_state['prompts']["tasks"].items():
-    st.session_state['prompts']["tasks"][task] = st.text_area(
-        f"{task.capitalize()} Task Description",
-        value=description,
-        key=f"{task}_description"
-    )
+# Edit settings in a form so typing does not rerun the script on every keystroke
+with st.form("gen_form"):
+    # Temperature slider
+    temperature = st.slider("Set the temperature for the output (0 = deterministic, 1 = creative)", 
+                           min_value=0.0, max_value=1.0, value=0.7)
+
+    # User inputs for each prompt
+    st.header("Agent Prompts")
+
+    for agent, prompts in st.session_state['prompts'].items():
+        if agent != "tasks":
+            st.subheader(f"{agent.capitalize()} Agent")
+            prompts["role"] = st.text_input(f"{agent.capitalize()} Role", 
+                                          value=prompts["role"], 
+                                          key=f"{agent}_role")
+            prompts["goal"] = st.text_area(f"{agent.capitalize()} Goal", 
+                                         value=prompts["goal"], 
+                                         key=f"{agent}_goal")
+            prompts["backstory"] = st.text_area(f"{agent.capitalize()} Backstory", 
+                                              value=prompts["backstory"], 
+                                              key=f"{agent}_backstory")
+
+    st.header("Task Descriptions")
+    for task, description in st.session_state['prompts']["tasks"].items():
+        st.session_state['prompts']["tasks"][task] = st.text_area(
+            f"{task.capitalize()} Task Description",
+            value=description,
+            key=f"{task}_description"
+        )
 
-# Button to save user modifications
-if st.button("Save Configuration"):
-    save_config(st.session_state['prompts'])
-    st.success("Configuration saved successfully!")
+    save_submitted = st.form_submit_button("Save Configuration")
+    generate_submitted = st.form_submit_button("Generate Research Article")
 
-# Button to start processing
-if st.button("Generate Research Article"):
-    if not uploaded_file:
-        st.error("Please upload a transcript file.")
-    elif not azure_api_key:
-        st.error("Please enter your Azure OpenAI API Key.")
+# Save user modifications
+if save_submitted:
+    if save_config(st.session_state['prompts']):
+        st.success("Configuration saved successfully!")
     else:
-        transcripts = uploaded_file.read().decode("utf-8")
-
-        try:
-            # Setup and test Azure OpenAI connection
-            if not setup_azure_openai():
-                st.error("Failed to setup Azure OpenAI connection. Please check your credentials.")
-                st.stop()
-
-            st.success("API connection successful!")
-
-            # Define agents with user-defined prompts and proper error handling
-            try:
-                planner = Agent(
-                    role=st.session_state['prompts']['planner']['role'],
-                    goal=st.session_state['prompts']['planner']['goal'],
-                    backstory=st.session_state['prompts']['planner']['backstory'],
-                    allow_delegation=False,
-                    verbose=True,
-                    temperature=temperature
-                )
-
-                writer = Agent(
-                    role=st.session_state['prompts']['writer']['role'],
-                    goal=st.session_state['prompts']['writer']['goal'],
-                    backstory=st.session_state['prompts']['writer']['backstory'],
-                    allow_delegation=False,
-                    verbose=True,
-                    temperature=temperature
-                )
+        st.info("Configuration unchanged, nothing to save.")
+
+# Build the agents once per prompt, temperature, deployment and key combination
+@st.cache_resource
+def build_agents(prompts_json, temperature, deployment, api_key):
+    prompts = json.loads(prompts_json)
+    llm = build_llm(temperature, deployment, api_key)
+
+    # Agents are reused across runs, so they must not keep conversation memory
+    planner = Agent(
+        role=prompts['planner']['role'],
+        goal=prompts['planner']['goal'],
+        backstory=prompts['planner']['backstory'],
+        allow_delegation=False,
+        verbose=True,
+        memory=False,
+        llm=llm
+    )
 
-                editor = Agent(
-                    role=st.session_state['prompts']['editor']['role'],
-                    goal=st.session_state['prompts']['editor']['goal'],
-                    backstory=st.session_state['prompts']['editor']['backstory'],
-                    allow_delegation=False,
-                    verbose=True,
-                    temperature=temperature
-                )
+    writer = Agent(
+        role=prompts['writer']['role'],
+        goal=prompts['writer']['goal'],
+        backstory=prompts['writer']['backstory'],
+        allow_delegation=False,
+        verbose=True,
+        memory=False,
+        llm=llm
+    )
 
-                # Define tasks with error handling
-                plan = Task(
-                    description=f"{st.session_state['prompts']['tasks']['plan']}: {transcripts}",
-                    agent=planner,
-                )
+    # Only the editor streams, since its output is the final article
+    editor = Agent(
+        role=prompts['editor']['role'],
+        goal=prompts['editor']['goal'],
+        backstory=prompts['editor']['backstory'],
+        allow_delegation=False,
+        verbose=True,
+        memory=False,
+        llm=build_llm(temperature, deployment, api_key, streaming=True)
+    )
 
+    return planner, writer, editor
+
+# Run the planner/writer/editor pipeline for a single transcript
+def generate_article(transcripts):
+    # Deterministic runs can be served from the response cache
+    cache_key = make_cache_key(transcripts, st.session_state['prompts'],
+                               azure_deployment, temperature)
+    cached_result = llm_cache.get(cache_key) if temperature == 0 else None
+
+    if cached_result is not None:
+        st.success("Research article loaded from cache!")
+        st.markdown(cached_result)
+        return
+
+    # Tokenize once for the embedding and planner budgets
+    encoding = get_encoding()
+    tokens = encoding.encode(transcripts)
+
+    # Near-duplicate transcripts can reuse an earlier article generated with the
+    # same prompts, deployment and temperature; like the exact cache, only for
+    # deterministic runs, and never when the slider is at 1.00. Transcripts longer
+    # than the embedding input are skipped: embedding only their opening tokens
+    # would match any other transcript that starts the same way
+    embedding = None
+    fingerprint = make_cache_key("", st.session_state['prompts'], azure_deployment, temperature)
+    if temperature == 0 and similarity_threshold < 1.0 and len(tokens) <= EMBEDDING_MAX_TOKENS:
+        try:
+            embedding = embed_text(transcripts)
+            cached_result = semantic_cache.lookup(embedding, fingerprint, similarity_threshold)
+        except Exception as embedding_error:
+            st.warning(f"Semantic cache unavailable: {str(embedding_error)}")
+            embedding = None
+
+    if cached_result is not None:
+        st.success("Research article loaded from semantic cache!")
+        st.markdown(cached_result)
+    else:
+        # Define agents with user-defined prompts and proper error handling
+        try:
+            prompts_json = json.dumps(st.session_state['prompts'], sort_keys=True)
+            static_prompts = render_static_prompts(prompts_json)
+            planner, writer, editor = build_agents(
+                prompts_json,
+                temperature,
+                azure_deployment,
+                azure_api_key
+            )
+
+            # Very long transcripts are summarized chunk by chunk before planning,
+            # and the summary is cut to the budget if it is still too long
+            if len(tokens) > TRANSCRIPT_TOKEN_BUDGET:
+                with st.spinner("Summarizing long transcript..."):
+                    transcripts = run_interruptible(asyncio.run, summarize_transcript(transcripts))
+                tokens = encoding.encode(transcripts)
+                if len(tokens) > TRANSCRIPT_TOKEN_BUDGET:
+                    transcripts = encoding.decode(tokens[:TRANSCRIPT_TOKEN_BUDGET])
+
+            # Define tasks with error handling
+            plan = Task(
+                description=f"{static_prompts['plan_prefix']}: {transcripts}",
+                agent=planner,
+            )
+
+            style = Task(
+                description=STYLE_RULES_TASK,
+                agent=editor
+            )
+
+            # The content plan and the editor's style rules do not depend on each other
+            prep_crew = Crew(
+                agents=[planner],
+                tasks=[plan],
+                verbose=True
+            )
+
+            style_crew = Crew(
+                agents=[editor],
+                tasks=[style],
+                verbose=True
+            )
+
+            # Process the transcript with progress indication
+            with st.spinner("Generating research article... This may take a few minutes."):
+                run_interruptible(asyncio.run, prepare_article(prep_crew, style_crew))
+
+                # Downstream tasks read the plan and style rules through task context
+                # (their outputs are kept on the finished tasks) instead of re-pasting text
                 write = Task(
-                    description=st.session_state['prompts']['tasks']['write'],
+                    description=static_prompts['write'],
                     agent=writer,
+                    context=[plan]
                 )
 
                 edit = Task(
-                    description=st.session_state['prompts']['tasks']['edit'],
-                    agent=editor
+                    description=static_prompts['edit'],
+                    agent=editor,
+                    context=[write, style]
                 )
 
                 # Create and execute crew
                 crew = Crew(
-                    agents=[planner, writer, editor],
-                    tasks=[plan, write, edit],
+                    agents=[writer, editor],
+                    tasks=[write, edit],
                     verbose=True
                 )
 
-                # Process the transcript with progress indication
-                with st.spinner("Generating research article... This may take a few minutes."):
-                    result = crew.kickoff()
+            # Do not start the billed writer/editor crew for a run that was stopped
+            if run_aborted():
+                st.info("Generation stopped.")
+                return
+
+            # Stream the editor's output while the final crew runs
+            stream_area = st.empty()
+            with stream_area.container():
+                result = stream_crew(crew)
+            stream_area.empty()
+
+            if temperature == 0:
+                llm_cache.set(cache_key, str(result), ttl=CACHE_TTL_SECONDS)
+            if embedding is not None:
+                semantic_cache.add(embedding, fingerprint, str(result))
+
+            # Display the result
+            st.success("Research article generated successfully!")
+            st.markdown(result)
+
+        except Exception as agent_error:
+            st.error(f"Error in agent/task setup: {str(agent_error)}")
+            st.error(f"Detailed error: {traceback.format_exc()}")
+
+# Report a run cancelled with the Stop button
+if st.session_state.pop('_abort', False):
+    st.info("Generation stopped.")
+
+# Start processing
+if generate_submitted:
+    if not uploaded_files:
+        st.error("Please upload at least one transcript file.")
+    elif not azure_api_key and not use_entra_id:
+        st.error("Please enter your Azure OpenAI API Key.")
+    else:
+        try:
+            # Setup and test Azure OpenAI connection
+            if not setup_azure_openai():
+                st.error("Failed to setup Azure OpenAI connection. Please check your credentials.")
+                st.stop()
 
-                # Display the result
-                st.success("Research article generated successfully!")
-                st.markdown(result)
+            st.success("API connection successful!")
 
-            except Exception as agent_error:
-                st.error(f"Error in agent/task setup: {str(agent_error)}")
-                st.error(f"Detailed error: {traceback.format_exc()}")
+            if batch_mode:
+                submit_batch(uploaded_files)
+            else:
+                start_run()
+                st.button("Stop", on_click=request_abort)
+                for uploaded_file in uploaded_files:
+                    st.subheader(uploaded_file.name)
+                    generate_article(read_transcript(uploaded_file))
 
         except requests.exceptions.RequestException as api_error:
             st.error("API Error occurred:")
             st.error(f"Error details: {str(api_error)}")
-            if hasattr(api_error, 'response'):
+            if getattr(api_error, 'response', None) is not None:
                 st.error(f"Response Status Code: {api_error.response.status_code}")
                 st.error(f"Response Content: {api_error.response.text}")
         except Exception as e:
             st.error(f"An unexpected error occurred: {str(e)}")
             st.error(f"Traceback: {traceback.format_exc()}")
 
+# Update cache counters after this run's lookups
+cache_stats.write(f"Hits: {llm_cache.hits} | Misses: {llm_cache.misses}")
+
 st.markdown("---")
 st.markdown("Tapestry Networks")
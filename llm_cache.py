@@ -0,0 +1,36 @@
+import hashlib
+import json
+
+
+# Build a stable cache key for a generation run
+def make_cache_key(transcripts, prompts, deployment, temperature):
+    payload = json.dumps(
+        {"t": transcripts, "p": prompts, "d": deployment, "temp": temperature},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# Response cache kept in a StateStore, with per-instance hit/miss counters
+class SQLiteCacheBackend:
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.store.cache_get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value.decode("utf-8")
+
+    def set(self, key, value, ttl=None):
+        self.store.cache_set(key, value.encode("utf-8"), ttl=ttl)
+
+    def clear(self):
+        self.store.cache_clear()
+        self.hits = 0
+        self.misses = 0
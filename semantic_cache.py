@@ -0,0 +1,33 @@
+import numpy as np
+
+
+# Normalize an embedding so a dot product equals cosine similarity
+def normalize(embedding):
+    vector = np.asarray(embedding, dtype="float32")
+    return vector / np.linalg.norm(vector)
+
+
+# Article cache looked up by transcript embedding similarity. Rows live in the
+# shared StateStore with real row ids, and are only matched against rows saved
+# under the same config fingerprint (prompts, deployment, temperature).
+class SemanticCache:
+    def __init__(self, store):
+        self.store = store
+
+    def lookup(self, embedding, fingerprint, threshold):
+        rows = self.store.semantic_rows(fingerprint)
+        if not rows:
+            return None
+
+        vectors = np.vstack([np.frombuffer(row[0], dtype="float32") for row in rows])
+        scores = vectors @ normalize(embedding)
+        best = int(np.argmax(scores))
+        if scores[best] <= threshold:
+            return None
+        return rows[best][1].decode("utf-8")
+
+    def add(self, embedding, fingerprint, article):
+        self.store.semantic_add(fingerprint, normalize(embedding).tobytes(), article.encode("utf-8"))
+
+    def clear(self):
+        self.store.semantic_clear()
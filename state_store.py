@@ -0,0 +1,75 @@
+import sqlite3
+import threading
+import time
+
+
+# Single SQLite file holding the saved config and the LLM response caches,
+# so every Streamlit process shares both without racing on separate files
+class StateStore:
+    def __init__(self, path="state.db"):
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.con:
+            # WAL lets readers in other processes proceed while one process writes
+            self.con.execute("PRAGMA journal_mode=WAL")
+            self.con.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, v BLOB)")
+            self.con.execute("CREATE TABLE IF NOT EXISTS llm_cache(k TEXT PRIMARY KEY, v BLOB, ts INTEGER)")
+            self.con.execute(
+                "CREATE TABLE IF NOT EXISTS semantic_cache("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, fingerprint TEXT, embedding BLOB, article BLOB)"
+            )
+            self.con.execute(
+                "CREATE INDEX IF NOT EXISTS semantic_cache_fingerprint ON semantic_cache(fingerprint)"
+            )
+
+    def get(self, key):
+        with self.lock:
+            row = self.con.execute("SELECT v FROM kv WHERE k = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        with self.lock, self.con:
+            self.con.execute("INSERT OR REPLACE INTO kv(k, v) VALUES (?, ?)", (key, value))
+
+    # Cached responses; ts holds the expiry time in epoch seconds, NULL meaning no expiry
+    def cache_get(self, key):
+        with self.lock:
+            row = self.con.execute(
+                "SELECT v FROM llm_cache WHERE k = ? AND (ts IS NULL OR ts >= ?)",
+                (key, int(time.time()))
+            ).fetchone()
+        return row[0] if row else None
+
+    def cache_set(self, key, value, ttl=None):
+        now = int(time.time())
+        expires_at = now + ttl if ttl else None
+        with self.lock, self.con:
+            # Drop expired entries so the table does not grow without bound
+            self.con.execute("DELETE FROM llm_cache WHERE ts IS NOT NULL AND ts < ?", (now,))
+            self.con.execute(
+                "INSERT OR REPLACE INTO llm_cache(k, v, ts) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+
+    def cache_clear(self):
+        with self.lock, self.con:
+            self.con.execute("DELETE FROM llm_cache")
+
+    # Embedding/article pairs for the semantic cache, grouped by config fingerprint
+    def semantic_rows(self, fingerprint):
+        with self.lock:
+            return self.con.execute(
+                "SELECT embedding, article FROM semantic_cache WHERE fingerprint = ?",
+                (fingerprint,)
+            ).fetchall()
+
+    def semantic_add(self, fingerprint, embedding, article):
+        with self.lock, self.con:
+            self.con.execute(
+                "INSERT INTO semantic_cache(fingerprint, embedding, article) VALUES (?, ?, ?)",
+                (fingerprint, embedding, article)
+            )
+
+    def semantic_clear(self):
+        with self.lock, self.con:
+            self.con.execute("DELETE FROM semantic_cache")